@@ -7,7 +7,10 @@ TestGyp.py:  a testing framework for GYP integration tests.
 """
 
 import collections
+import functools
 import itertools
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import shutil
@@ -24,18 +27,27 @@ __all__.extend([
   'TestGyp',
 ])
 
+# The host platform checks made on every built-file lookup and run.
+_IS_DARWIN = sys.platform == 'darwin'
+_IS_WIN32 = sys.platform == 'win32'
+
+_is_list = TestCmd.is_List
+
+# Matches the "MODE:file.py:line:" prefix of each line of gyp's debug output;
+# the third column is the line number.
+_DEBUG_LINE_PREFIX_RE = re.compile(r'^[^:\n]*:[^:\n]*:[^:\n]*:', re.M)
+
 def remove_debug_line_numbers(contents):
   """Function to remove the line numbers from the debug output
   of gyp and thus remove the exremem fragility of the stdout
   comparison tests.
   """
-  lines = contents.splitlines()
-  # split each line on ":"
-  lines = [l.split(":", 3) for l in lines]
-  # join each line back together while ignoring the
-  # 3rd column which is the line number
-  lines = [len(l) > 3 and ":".join(l[3:]) or l for l in lines]
-  return "\n".join(lines)
+  # Normalize line endings the way splitlines() + join() used to, then
+  # strip everything up to and including the line number column.
+  contents = _DEBUG_LINE_PREFIX_RE.sub('', contents.replace('\r\n', '\n'))
+  if contents.endswith('\n'):
+    contents = contents[:-1]
+  return contents
 
 def match_modulo_line_numbers(contents_a, contents_b):
   """File contents matcher that ignores line numbers."""
@@ -43,6 +55,115 @@ def match_modulo_line_numbers(contents_a, contents_b):
   contents_b = remove_debug_line_numbers(contents_b)
   return TestCommon.match_exact(contents_a, contents_b)
 
+# Size of the buffer used by _fastcopy().  shutil.copyfile() uses 16KB
+# chunks, which costs a lot of read/write round trips on network file systems.
+_COPY_BUFSIZE = 1 << 20
+
+def _fastcopy(source, destination):
+  """Copies the contents of the file source to destination.
+
+  Unlike shutil.copyfile(), this skips the samefile/special-file checks
+  (test fixtures are always regular files being copied into a fresh
+  directory) and moves data in large chunks.
+  """
+  fsrc = open(source, 'rb')
+  try:
+    fdst = open(destination, 'wb')
+    try:
+      shutil.copyfileobj(fsrc, fdst, _COPY_BUFSIZE)
+    finally:
+      fdst.close()
+  finally:
+    fsrc.close()
+
+def _copystat_minimal(st, destination):
+  """Copies the times and permission bits from the source's stat result
+  to destination.
+
+  This is the part of shutil.copystat() that tests depend on; it doesn't
+  stat the source again and skips file flags.
+  """
+  os.utime(destination, (st.st_atime, st.st_mtime))
+  os.chmod(destination, stat.S_IMODE(st.st_mode))
+
+def _copy_test_file(entry):
+  """Copies one (source, destination, stat) entry from _walk_test_tree()."""
+  source, destination, st = entry
+  _fastcopy(source, destination)
+  _copystat_minimal(st, destination)
+
+# Test trees with fewer files than this are copied serially; spinning up
+# the thread pool isn't worth it for the handful of files most tests have.
+_PARALLEL_COPY_THRESHOLD = 16
+
+# Thread pool shared by file system operations that are I/O bound.  File
+# I/O releases the GIL, so threads overlap the system calls.  Created on
+# first use by _io_pool().
+_io_thread_pool = None
+
+def _io_pool():
+  """Returns the shared I/O thread pool, creating it if necessary."""
+  global _io_thread_pool
+  if _io_thread_pool is None:
+    try:
+      cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+      cpus = 1
+    _io_thread_pool = multiprocessing.pool.ThreadPool(min(32, cpus * 4))
+  return _io_thread_pool
+
+# Entries of a test tree that copy_test_configuration() doesn't copy.
+_SKIP_PREFIX = ('gyptest',)
+_SKIP_EXACT = frozenset(['.svn'])
+
+def _walk_test_tree(source_dir, dest_dir):
+  """Yields (source, destination, stat) for every entry of a test tree.
+
+  Directories are yielded before their contents.  Each entry is stat()ed
+  exactly once and the result is handed to the caller, so copying its
+  metadata doesn't need to stat the source again.  Symbolic links are
+  followed but, like os.walk(), not descended into.
+  """
+  for name in os.listdir(source_dir):
+    if name in _SKIP_EXACT or name.startswith(_SKIP_PREFIX):
+      continue
+    source = os.path.join(source_dir, name)
+    destination = os.path.join(dest_dir, name)
+    st = os.lstat(source)
+    if stat.S_ISLNK(st.st_mode):
+      yield source, destination, os.stat(source)
+      continue
+    yield source, destination, st
+    if stat.S_ISDIR(st.st_mode):
+      for entry in _walk_test_tree(source, destination):
+        yield entry
+
+def _set_environ(name, value):
+  """Sets the environment variable name to value.
+
+  Assigning to os.environ calls putenv(), so the assignment is skipped
+  when the variable already has that value.
+  """
+  if os.environ.get(name) != value:
+    os.environ[name] = value
+
+# Results of _project_file_name(), keyed by (gyp_file, extension).
+_project_file_names = {}
+
+def _project_file_name(gyp_file, extension):
+  """Returns the name of the project file (.sln, .xcodeproj) generated
+  from gyp_file, by replacing '.gyp' with the specified extension.
+  """
+  key = (gyp_file, extension)
+  name = _project_file_names.get(key)
+  if name is None:
+    name = _project_file_names[key] = gyp_file.replace('.gyp', extension)
+  return name
+
+# Results of TestGypBase.where_is() lookups of build tools, keyed by
+# (tool, $PATH, %PATHEXT%).
+_where_is_cache = {}
+
 class TestGypBase(TestCommon.TestCommon):
   """
   Class for controlling end-to-end tests of gyp generators.
@@ -83,6 +204,13 @@ class TestGypBase(TestCommon.TestCommon):
   STATIC_LIB = '__static_lib__'
   SHARED_LIB = '__shared_lib__'
 
+  # Prefix and suffix that built_file_basename() adds for each target type.
+  _basename_affixes = {
+    EXECUTABLE: ('', _exe),
+    STATIC_LIB: (lib_, _lib),
+    SHARED_LIB: (dll_, _dll),
+  }
+
   def __init__(self, gyp=None, *args, **kw):
     self.origin_cwd = os.path.abspath(os.path.dirname(sys.argv[0]))
     self.extra_args = sys.argv[1:]
@@ -90,12 +218,14 @@ class TestGypBase(TestCommon.TestCommon):
     if not gyp:
       gyp = os.environ.get('TESTGYP_GYP')
       if not gyp:
-        if sys.platform == 'win32':
+        if _IS_WIN32:
           gyp = 'gyp.bat'
         else:
           gyp = 'gyp'
     self.gyp = os.path.abspath(gyp)
     self.no_parallel = False
+    self._basename_cache = {}
+    self._up_to_date_output_cache = {}
 
     self.initialize_build_tool()
 
@@ -174,21 +304,22 @@ class TestGypBase(TestCommon.TestCommon):
     This ignores all files and directories that begin with
     the string 'gyptest', and all '.svn' subdirectories.
     """
-    for root, dirs, files in os.walk(source_dir):
-      if '.svn' in dirs:
-        dirs.remove('.svn')
-      dirs = [ d for d in dirs if not d.startswith('gyptest') ]
-      files = [ f for f in files if not f.startswith('gyptest') ]
-      for dirname in dirs:
-        source = os.path.join(root, dirname)
-        destination = source.replace(source_dir, dest_dir)
+    # Directories are created serially, parents before children, while
+    # walking; the file copies are independent and may run in parallel.
+    files = []
+    for entry in _walk_test_tree(source_dir, dest_dir):
+      source, destination, st = entry
+      if stat.S_ISDIR(st.st_mode):
         os.mkdir(destination)
-        if sys.platform != 'win32':
-          shutil.copystat(source, destination)
-      for filename in files:
-        source = os.path.join(root, filename)
-        destination = source.replace(source_dir, dest_dir)
-        shutil.copy2(source, destination)
+        if not _IS_WIN32:
+          _copystat_minimal(st, destination)
+      else:
+        files.append(entry)
+    if len(files) < _PARALLEL_COPY_THRESHOLD:
+      for entry in files:
+        _copy_test_file(entry)
+    else:
+      _io_pool().map(_copy_test_file, files, chunksize=8)
 
   def initialize_build_tool(self):
     """
@@ -204,7 +335,7 @@ class TestGypBase(TestCommon.TestCommon):
       if os.path.isabs(build_tool):
         self.build_tool = build_tool
         return
-      build_tool = self.where_is(build_tool)
+      build_tool = self._where_is_cached(build_tool)
       if build_tool:
         self.build_tool = build_tool
         return
@@ -212,6 +343,19 @@ class TestGypBase(TestCommon.TestCommon):
     if self.build_tool_list:
       self.build_tool = self.build_tool_list[0]
 
+  def _where_is_cached(self, build_tool):
+    """
+    Returns self.where_is(build_tool), remembering the result for the
+    current $PATH (and %PATHEXT%) so that every instance doesn't have to
+    search it again.
+    """
+    key = (build_tool, os.environ.get('PATH'), os.environ.get('PATHEXT'))
+    try:
+      return _where_is_cache[key]
+    except KeyError:
+      result = _where_is_cache[key] = self.where_is(build_tool)
+      return result
+
   def relocate(self, source, destination):
     """
     Renames (relocates) the specified source (usually a directory)
@@ -236,13 +380,28 @@ class TestGypBase(TestCommon.TestCommon):
     that expect exact output from the command (make) can
     just set stdout= when they call the run_build() method.
     """
-    print "Build is not up-to-date:"
-    print self.banner('STDOUT ')
-    print self.stdout()
+    chunks = ['Build is not up-to-date:\n',
+              self.banner('STDOUT '), '\n',
+              self.stdout(), '\n']
     stderr = self.stderr()
     if stderr:
-      print self.banner('STDERR ')
-      print stderr
+      chunks.extend([self.banner('STDERR '), '\n', stderr, '\n'])
+    sys.stdout.writelines(chunks)
+
+  def is_up_to_date_output(self, stdout):
+    """
+    Returns whether the specified build tool stdout reports an up-to-date
+    build, as determined by the subclass's scan_up_to_date_output().
+
+    Tests often verify the same output repeatedly, so results are cached
+    per output string.
+    """
+    try:
+      return self._up_to_date_output_cache[stdout]
+    except KeyError:
+      result = self.scan_up_to_date_output(stdout)
+      self._up_to_date_output_cache[stdout] = result
+      return result
 
   def run_gyp(self, gyp_file, *args, **kw):
     """
@@ -282,12 +441,28 @@ class TestGypBase(TestCommon.TestCommon):
     tool and testing potential built output.
     """
     self.configuration = configuration
+    if configuration:
+      self._configuration_dirname = configuration.split('|')[0]
+    else:
+      self._configuration_dirname = 'Default'
+    self._built_file_path_cache = {}
+    self._output_dirs = {}
 
   def configuration_dirname(self):
-    if self.configuration:
-      return self.configuration.split('|')[0]
-    else:
-      return 'Default'
+    return self._configuration_dirname
+
+  def _output_dir(self, root):
+    """
+    Returns the root/{configuration} directory, cached until the
+    configuration changes.
+    """
+    try:
+      return self._output_dirs[root]
+    except KeyError:
+      pass
+    result = self._output_dirs[root] = os.path.join(
+        root, self.configuration_dirname())
+    return result
 
   def configuration_buildname(self):
     if self.configuration:
@@ -314,6 +489,30 @@ class TestGypBase(TestCommon.TestCommon):
   def built_file_path(self, name, type=None, **kw):
     """
     Returns a path to the specified file name, of the specified type.
+
+    Paths are computed by the subclass's _built_file_path() and cached
+    until the configuration changes.
+    """
+    if kw:
+      key = (name, type, tuple(sorted(kw.iteritems())))
+    else:
+      # Most lookups (e.g. from run_built_executable()) pass no keywords,
+      # so skip building and sorting their items.
+      key = (name, type)
+    try:
+      return self._built_file_path_cache[key]
+    except KeyError:
+      pass
+    except TypeError:
+      # Unhashable keyword argument values; don't cache.
+      return self._built_file_path(name, type, **kw)
+    result = self._built_file_path(name, type, **kw)
+    self._built_file_path_cache[key] = result
+    return result
+
+  def _built_file_path(self, name, type=None, **kw):
+    """
+    Computes the path returned by built_file_path().
     """
     raise NotImplementedError
 
@@ -324,14 +523,16 @@ class TestGypBase(TestCommon.TestCommon):
     A bare=True keyword argument specifies that prefixes and suffixes shouldn't
     be applied.
     """
-    if not kw.get('bare'):
-      if type == self.EXECUTABLE:
-        name = name + self._exe
-      elif type == self.STATIC_LIB:
-        name = self.lib_ + name + self._lib
-      elif type == self.SHARED_LIB:
-        name = self.dll_ + name + self._dll
-    return name
+    if kw.get('bare'):
+      return name
+    key = (name, type)
+    try:
+      return self._basename_cache[key]
+    except KeyError:
+      pass
+    prefix, suffix = self._basename_affixes.get(type, ('', ''))
+    result = self._basename_cache[key] = prefix + name + suffix
+    return result
 
   def run_built_executable(self, name, *args, **kw):
     """
@@ -343,6 +544,14 @@ class TestGypBase(TestCommon.TestCommon):
     """
     raise NotImplementedError
 
+  def scan_up_to_date_output(self, stdout):
+    """
+    Returns whether the specified build tool stdout reports an up-to-date
+    build.  Used through is_up_to_date_output() by subclasses whose tools
+    don't make that a simple exact match.
+    """
+    raise NotImplementedError
+
   def up_to_date(self, gyp_file, target=None, **kw):
     """
     Verifies that a build of the specified target is up to date.
@@ -378,6 +587,19 @@ class TestGypCustom(TestGypBase):
     super(TestGypCustom, self).__init__(*args, **kw)
 
 
+def _entries_ending_with(directory, suffix):
+  """Returns the paths of the entries of directory whose names end with
+  suffix.
+  """
+  return [os.path.join(directory, name) for name in os.listdir(directory)
+          if name.endswith(suffix)]
+
+
+# Compiled regular expressions used by TestGypAndroid.match_single_line(),
+# keyed by the expected line.
+_single_line_res = {}
+
+
 class TestGypAndroid(TestGypBase):
   """
   Subclass for testing the GYP Android makefile generator. Note that
@@ -408,6 +630,13 @@ class TestGypAndroid(TestGypBase):
     # backend. This writes to the source tree, but there's no way around this.
     kw['workdir'] = os.path.join('/tmp', 'gyptest',
                                  kw.get('workdir', 'testworkarea'))
+    # The Android environment doesn't change during a test; read it once.
+    self._android_product_out = os.environ['ANDROID_PRODUCT_OUT']
+    self._android_build_top = os.environ['ANDROID_BUILD_TOP']
+    self._obj_dir = os.path.join(self._android_product_out, 'obj')
+    self._group_roots = dict(
+        (g, os.path.join(self._obj_dir, g))
+        for g in ('EXECUTABLES', 'STATIC_LIBRARIES', 'SHARED_LIBRARIES'))
     # We need to remove all gyp outputs from out/. Ths is because some tests
     # don't have rules to regenerate output, so they will simply re-use stale
     # output if present. Since the test working directory gets regenerated for
@@ -415,17 +644,21 @@ class TestGypAndroid(TestGypBase):
     # We don't have a list of build outputs because we don't know which
     # dependent targets were built. Instead we delete all gyp-generated output.
     # This may be excessive, but should be safe.
-    out_dir = os.environ['ANDROID_PRODUCT_OUT']
-    obj_dir = os.path.join(out_dir, 'obj')
-    shutil.rmtree(os.path.join(obj_dir, 'GYP'), ignore_errors = True)
-    for x in ['EXECUTABLES', 'STATIC_LIBRARIES', 'SHARED_LIBRARIES']:
-      for d in os.listdir(os.path.join(obj_dir, x)):
-        if d.endswith('_gyp_intermediates'):
-          shutil.rmtree(os.path.join(obj_dir, x, d), ignore_errors = True)
-    for x in [os.path.join('obj', 'lib'), os.path.join('system', 'lib')]:
-      for d in os.listdir(os.path.join(out_dir, x)):
-        if d.endswith('_gyp.so'):
-          os.remove(os.path.join(out_dir, x, d))
+    # The removals are independent of each other, so they run on the shared
+    # I/O thread pool.
+    victim_dirs = [os.path.join(self._obj_dir, 'GYP')]
+    for group_root in self._group_roots.itervalues():
+      victim_dirs.extend(_entries_ending_with(group_root,
+                                              '_gyp_intermediates'))
+    victim_files = []
+    for x in [os.path.join(self._obj_dir, 'lib'),
+              os.path.join(self._android_product_out, 'system', 'lib')]:
+      victim_files.extend(_entries_ending_with(x, '_gyp.so'))
+    pool = _io_pool()
+    removing_dirs = pool.map_async(
+        functools.partial(shutil.rmtree, ignore_errors=True), victim_dirs)
+    pool.map(os.remove, victim_files)
+    removing_dirs.get()
 
     super(TestGypAndroid, self).__init__(*args, **kw)
 
@@ -446,7 +679,7 @@ class TestGypAndroid(TestGypBase):
     arguments = kw.get('arguments', [])[:]
     arguments.append(self.target_name(target))
     arguments.append('-C')
-    arguments.append(os.environ['ANDROID_BUILD_TOP'])
+    arguments.append(self._android_build_top)
     kw['arguments'] = arguments
     chdir = kw.get('chdir', '')
     makefile = os.path.join(self.workdir, chdir, 'GypAndroid.mk')
@@ -463,10 +696,9 @@ class TestGypAndroid(TestGypBase):
     return '%s_gyp' % name
 
   def intermediates_dir(self, group, module_name):
-    return os.path.join(os.environ['ANDROID_PRODUCT_OUT'], 'obj', group,
-                        '%s_intermediates' % module_name)
+    return self._group_roots[group] + os.sep + module_name + '_intermediates'
 
-  def built_file_path(self, name, type=None, **kw):
+  def _built_file_path(self, name, type=None, **kw):
     """
     Returns a path to the specified file name, of the specified type,
     as built by Android. Note that we don't support the configuration
@@ -475,8 +707,7 @@ class TestGypAndroid(TestGypBase):
     # Built files are in $ANDROID_PRODUCT_OUT. This requires copying logic from
     # the Android build system.
     if type == None:
-      return os.path.join(os.environ['ANDROID_PRODUCT_OUT'], 'obj', 'GYP',
-                          'shared_intermediates', name)
+      return os.path.join(self._obj_dir, 'GYP', 'shared_intermediates', name)
     subdir = kw.get('subdir')
     if type == self.EXECUTABLE:
       # We don't install executables
@@ -517,9 +748,12 @@ class TestGypAndroid(TestGypBase):
     """
     Checks that specified line appears in the text.
     """
-    for line in lines.split('\n'):
-        if line == expected_line:
-            return 1
+    expected_re = _single_line_res.get(expected_line)
+    if expected_re is None:
+      expected_re = re.compile('^%s$' % re.escape(expected_line), re.M)
+      _single_line_res[expected_line] = expected_re
+    if expected_re.search(lines):
+      return 1
     return
 
   def up_to_date(self, gyp_file, target=None, **kw):
@@ -543,6 +777,15 @@ class TestGypCMake(TestGypBase):
   build_tool_list = ['cmake']
   ALL = 'all'
 
+  # Subdirectory of out/{configuration} that holds each type of library.
+  if _IS_DARWIN:
+    _type_subdirs = {}
+  elif _IS_WIN32:
+    _type_subdirs = {TestGypBase.STATIC_LIB: 'obj.target'}
+  else:
+    _type_subdirs = {TestGypBase.STATIC_LIB: 'obj.target',
+                     TestGypBase.SHARED_LIB: 'lib.target'}
+
   def cmake_build(self, gyp_file, target=None, **kw):
     arguments = kw.get('arguments', [])[:]
 
@@ -573,7 +816,7 @@ class TestGypCMake(TestGypBase):
 
     # Add a -C output/path to the command line.
     arguments.append('-C')
-    arguments.append(os.path.join('out', self.configuration_dirname()))
+    arguments.append(self._output_dir('out'))
 
     if target not in (None, self.DEFAULT):
       arguments.append(target)
@@ -602,29 +845,19 @@ class TestGypCMake(TestGypBase):
   def run_built_executable(self, name, *args, **kw):
     # Enclosing the name in a list avoids prepending the original dir.
     program = [self.built_file_path(name, type=self.EXECUTABLE, **kw)]
-    if sys.platform == 'darwin':
-      configuration = self.configuration_dirname()
-      os.environ['DYLD_LIBRARY_PATH'] = os.path.join('out', configuration)
+    if _IS_DARWIN:
+      _set_environ('DYLD_LIBRARY_PATH', self._output_dir('out'))
     return self.run(program=program, *args, **kw)
 
-  def built_file_path(self, name, type=None, **kw):
-    result = []
-    chdir = kw.get('chdir')
-    if chdir:
-      result.append(chdir)
-    result.append('out')
-    result.append(self.configuration_dirname())
-    if type == self.STATIC_LIB:
-      if sys.platform != 'darwin':
-        result.append('obj.target')
-    elif type == self.SHARED_LIB:
-      if sys.platform != 'darwin' and sys.platform != 'win32':
-        result.append('lib.target')
-    subdir = kw.get('subdir')
-    if subdir and type != self.SHARED_LIB:
-      result.append(subdir)
-    result.append(self.built_file_basename(name, type, **kw))
-    return self.workpath(*result)
+  def _built_file_path(self, name, type=None, **kw):
+    if type == self.SHARED_LIB:
+      subdir = None
+    else:
+      subdir = kw.get('subdir')
+    parts = (kw.get('chdir'), 'out', self.configuration_dirname(),
+             self._type_subdirs.get(type), subdir,
+             self.built_file_basename(name, type, **kw))
+    return self.workpath(*filter(None, parts))
 
   def up_to_date(self, gyp_file, target=None, **kw):
     result = self.ninja_build(gyp_file, target, **kw)
@@ -643,6 +876,14 @@ class TestGypMake(TestGypBase):
   format = 'make'
   build_tool_list = ['make']
   ALL = 'all'
+
+  # Subdirectory of out/{configuration} that holds each type of library.
+  # Mac puts target libraries right in the product directory.
+  if _IS_DARWIN:
+    _type_subdirs = {}
+  else:
+    _type_subdirs = {TestGypBase.STATIC_LIB: 'obj.target',
+                     TestGypBase.SHARED_LIB: 'lib.target'}
   def build(self, gyp_file, target=None, **kw):
     """
     Runs a Make build using the Makefiles generated from the specified
@@ -676,20 +917,18 @@ class TestGypMake(TestGypBase):
     """
     Runs an executable built by Make.
     """
-    configuration = self.configuration_dirname()
-    libdir = os.path.join('out', configuration, 'lib')
+    outdir = self._output_dir('out')
+    libdir = os.path.join(outdir, 'lib')
     # TODO(piman): when everything is cross-compile safe, remove lib.target
-    if sys.platform == 'darwin':
+    if _IS_DARWIN:
       # Mac puts target shared libraries right in the product directory.
-      configuration = self.configuration_dirname()
-      os.environ['DYLD_LIBRARY_PATH'] = (
-          libdir + '.host:' + os.path.join('out', configuration))
+      _set_environ('DYLD_LIBRARY_PATH', libdir + '.host:' + outdir)
     else:
-      os.environ['LD_LIBRARY_PATH'] = libdir + '.host:' + libdir + '.target'
+      _set_environ('LD_LIBRARY_PATH', libdir + '.host:' + libdir + '.target')
     # Enclosing the name in a list avoids prepending the original dir.
     program = [self.built_file_path(name, type=self.EXECUTABLE, **kw)]
     return self.run(program=program, *args, **kw)
-  def built_file_path(self, name, type=None, **kw):
+  def _built_file_path(self, name, type=None, **kw):
     """
     Returns a path to the specified file name, of the specified type,
     as built by Make.
@@ -706,29 +945,90 @@ class TestGypMake(TestGypBase):
     A subdir= keyword argument specifies a library subdirectory within
     the default 'obj.target'.
     """
-    result = []
-    chdir = kw.get('chdir')
-    if chdir:
-      result.append(chdir)
-    configuration = self.configuration_dirname()
-    result.extend(['out', configuration])
-    if type == self.STATIC_LIB and sys.platform != 'darwin':
-      result.append('obj.target')
-    elif type == self.SHARED_LIB and sys.platform != 'darwin':
-      result.append('lib.target')
-    subdir = kw.get('subdir')
-    if subdir and type != self.SHARED_LIB:
-      result.append(subdir)
-    result.append(self.built_file_basename(name, type, **kw))
-    return self.workpath(*result)
+    if type == self.SHARED_LIB:
+      subdir = None
+    else:
+      subdir = kw.get('subdir')
+    parts = (kw.get('chdir'), 'out', self.configuration_dirname(),
+             self._type_subdirs.get(type), subdir,
+             self.built_file_basename(name, type, **kw))
+    return self.workpath(*filter(None, parts))
+
+
+# Paths already converted by ConvertToCygpaths().
+_cygpath_cache = {}
 
 
 def ConvertToCygpath(path):
   """Convert to cygwin path if we are using cygwin."""
-  if sys.platform == 'cygwin':
-    p = subprocess.Popen(['cygpath', path], stdout=subprocess.PIPE)
-    path = p.communicate()[0].strip()
-  return path
+  return ConvertToCygpaths([path])[0]
+
+
+def ConvertToCygpaths(paths):
+  """Convert a list of paths to cygwin paths if we are using cygwin.
+
+  Paths that haven't been converted before are all passed to a single
+  cygpath invocation.
+  """
+  if sys.platform != 'cygwin':
+    return list(paths)
+  missing = [path for path in set(paths) if path not in _cygpath_cache]
+  if missing:
+    p = subprocess.Popen(['cygpath'] + missing, stdout=subprocess.PIPE)
+    converted = p.communicate()[0].splitlines()
+    for path, cygpath in zip(missing, converted):
+      _cygpath_cache[path] = cygpath.strip()
+  return [_cygpath_cache[path] for path in paths]
+
+
+# Location of devenv.com, relative to a Program Files directory, for each
+# Visual Studio version.
+_MSVS_DEVENV_PATHS = {
+    '2013': r'Microsoft Visual Studio 12.0\Common7\IDE\devenv.com',
+    '2012': r'Microsoft Visual Studio 11.0\Common7\IDE\devenv.com',
+    '2010': r'Microsoft Visual Studio 10.0\Common7\IDE\devenv.com',
+    '2008': r'Microsoft Visual Studio 9.0\Common7\IDE\devenv.com',
+    '2005': r'Microsoft Visual Studio 8\Common7\IDE\devenv.com'}
+
+# Cached results of _PossibleVisualStudioRoots(), _MayContainVisualStudio()
+# and FindVisualStudioInstallation().  The Visual Studio installation doesn't
+# move while tests are running, so probing the file system once is enough.
+_msvs_possible_roots = None
+_msvs_installation_cache = {}
+_msvs_root_listings = {}
+
+
+def _PossibleVisualStudioRoots():
+  """Returns the Program Files directories that may hold Visual Studio.
+
+  Only drives that actually exist are considered.
+  """
+  global _msvs_possible_roots
+  if _msvs_possible_roots is None:
+    drives = ['%s:\\' % chr(drive) for drive in range(ord('C'), ord('Z') + 1)]
+    drives = [d for d, path in zip(drives, ConvertToCygpaths(drives))
+              if os.path.isdir(path)]
+    possible_roots = ['%sProgram Files%s' % (drive, suffix)
+                      for drive in drives
+                      for suffix in ['', ' (x86)']]
+    _msvs_possible_roots = ConvertToCygpaths(possible_roots)
+  return _msvs_possible_roots
+
+
+def _MayContainVisualStudio(root, path):
+  """Returns whether root contains the top-level directory of path.
+
+  Each root is listed once, so absent drives and versions are ruled out
+  without probing every candidate devenv.com path individually.
+  """
+  names = _msvs_root_listings.get(root)
+  if names is None:
+    try:
+      names = frozenset(n.lower() for n in os.listdir(root))
+    except OSError:
+      names = frozenset()
+    _msvs_root_listings[root] = names
+  return path.split('\\', 1)[0].lower() in names
 
 
 def FindVisualStudioInstallation():
@@ -738,29 +1038,34 @@ def FindVisualStudioInstallation():
   We use the value specified by GYP_MSVS_VERSION.  If not specified, we
   search %PATH% and %PATHEXT% for a devenv.{exe,bat,...} executable.
   Failing that, we search for likely deployment paths.
-  """
-  possible_roots = ['%s:\\Program Files%s' % (chr(drive), suffix)
-                    for drive in range(ord('C'), ord('Z') + 1)
-                    for suffix in ['', ' (x86)']]
-  possible_paths = {
-      '2013': r'Microsoft Visual Studio 12.0\Common7\IDE\devenv.com',
-      '2012': r'Microsoft Visual Studio 11.0\Common7\IDE\devenv.com',
-      '2010': r'Microsoft Visual Studio 10.0\Common7\IDE\devenv.com',
-      '2008': r'Microsoft Visual Studio 9.0\Common7\IDE\devenv.com',
-      '2005': r'Microsoft Visual Studio 8\Common7\IDE\devenv.com'}
-
-  possible_roots = [ConvertToCygpath(r) for r in possible_roots]
 
+  The result is cached for each requested version.
+  """
   msvs_version = 'auto'
   for flag in (f for f in sys.argv if f.startswith('msvs_version=')):
     msvs_version = flag.split('=')[-1]
   msvs_version = os.environ.get('GYP_MSVS_VERSION', msvs_version)
 
+  try:
+    return _msvs_installation_cache[msvs_version]
+  except KeyError:
+    result = _FindVisualStudioInstallation(msvs_version)
+    _msvs_installation_cache[msvs_version] = result
+    return result
+
+
+def _FindVisualStudioInstallation(msvs_version):
+  """Uncached implementation of FindVisualStudioInstallation()."""
+  possible_roots = _PossibleVisualStudioRoots()
+  possible_paths = _MSVS_DEVENV_PATHS
+
   build_tool = None
   if msvs_version in possible_paths:
     # Check that the path to the specified GYP_MSVS_VERSION exists.
     path = possible_paths[msvs_version]
     for r in possible_roots:
+      if not _MayContainVisualStudio(r, path):
+        continue
       bt = os.path.join(r, path)
       if os.path.exists(bt):
         build_tool = bt
@@ -784,6 +1089,8 @@ def FindVisualStudioInstallation():
   for version in sorted(possible_paths, reverse=True):
     path = possible_paths[version]
     for r in possible_roots:
+      if not _MayContainVisualStudio(r, path):
+        continue
       bt = os.path.join(r, path)
       if os.path.exists(bt):
         build_tool = bt
@@ -792,6 +1099,29 @@ def FindVisualStudioInstallation():
   print 'Error: could not find devenv'
   sys.exit(1)
 
+# Environments produced by running a vsvars32.bat, keyed by its path.
+_vsvars_environments = {}
+
+def _GetVsvarsEnvironment(vsvars_path):
+  """Returns the environment set up by the specified vsvars32.bat.
+
+  The batch file is only run the first time a given path is requested.
+  """
+  env = _vsvars_environments.get(vsvars_path)
+  if env is None:
+    cmd = os.environ.get('COMSPEC', 'cmd.exe')
+    proc = subprocess.Popen([cmd, '/c', vsvars_path, '&&', 'set'],
+                            stdout=subprocess.PIPE)
+    output = proc.communicate()[0]
+    assert not proc.returncode
+    env = {}
+    for line in output.splitlines():
+      if '=' in line:
+        key, value = line.split('=', 1)
+        env[key] = value
+    _vsvars_environments[vsvars_path] = env
+  return env
+
 class TestGypOnMSToolchain(TestGypBase):
   """
   Common subclass for testing generators that target the Microsoft Visual
@@ -815,9 +1145,17 @@ class TestGypOnMSToolchain(TestGypBase):
     returning stdout."""
     assert sys.platform in ('win32', 'cygwin')
     cmd = os.environ.get('COMSPEC', 'cmd.exe')
-    arguments = [cmd, '/c', self.vsvars_path, '&&', 'dumpbin']
+    if _IS_WIN32:
+      # Running vsvars32.bat is the slow part, so reuse the environment
+      # it produces.  Cygwin would rewrite the Windows-style %PATH% on the
+      # way to cmd.exe, so there we still run it each time.
+      env = _GetVsvarsEnvironment(self.vsvars_path)
+      arguments = [cmd, '/c', 'dumpbin']
+    else:
+      env = None
+      arguments = [cmd, '/c', self.vsvars_path, '&&', 'dumpbin']
     arguments.extend(dumpbin_args)
-    proc = subprocess.Popen(arguments, stdout=subprocess.PIPE)
+    proc = subprocess.Popen(arguments, stdout=subprocess.PIPE, env=env)
     output = proc.communicate()[0]
     assert not proc.returncode
     return output
@@ -831,6 +1169,15 @@ class TestGypNinja(TestGypOnMSToolchain):
   ALL = 'all'
   DEFAULT = 'all'
 
+  # Subdirectory of out/{configuration} that holds each type of library.
+  if _IS_DARWIN:
+    _type_subdirs = {}
+  elif _IS_WIN32:
+    _type_subdirs = {TestGypBase.STATIC_LIB: 'obj'}
+  else:
+    _type_subdirs = {TestGypBase.STATIC_LIB: 'obj',
+                     TestGypBase.SHARED_LIB: 'lib'}
+
   def run_gyp(self, gyp_file, *args, **kw):
     TestGypBase.run_gyp(self, gyp_file, *args, **kw)
 
@@ -839,7 +1186,7 @@ class TestGypNinja(TestGypOnMSToolchain):
 
     # Add a -C output/path to the command line.
     arguments.append('-C')
-    arguments.append(os.path.join('out', self.configuration_dirname()))
+    arguments.append(self._output_dir('out'))
 
     if target is None:
       target = 'all'
@@ -851,29 +1198,19 @@ class TestGypNinja(TestGypOnMSToolchain):
   def run_built_executable(self, name, *args, **kw):
     # Enclosing the name in a list avoids prepending the original dir.
     program = [self.built_file_path(name, type=self.EXECUTABLE, **kw)]
-    if sys.platform == 'darwin':
-      configuration = self.configuration_dirname()
-      os.environ['DYLD_LIBRARY_PATH'] = os.path.join('out', configuration)
+    if _IS_DARWIN:
+      _set_environ('DYLD_LIBRARY_PATH', self._output_dir('out'))
     return self.run(program=program, *args, **kw)
 
-  def built_file_path(self, name, type=None, **kw):
-    result = []
-    chdir = kw.get('chdir')
-    if chdir:
-      result.append(chdir)
-    result.append('out')
-    result.append(self.configuration_dirname())
-    if type == self.STATIC_LIB:
-      if sys.platform != 'darwin':
-        result.append('obj')
-    elif type == self.SHARED_LIB:
-      if sys.platform != 'darwin' and sys.platform != 'win32':
-        result.append('lib')
-    subdir = kw.get('subdir')
-    if subdir and type != self.SHARED_LIB:
-      result.append(subdir)
-    result.append(self.built_file_basename(name, type, **kw))
-    return self.workpath(*result)
+  def _built_file_path(self, name, type=None, **kw):
+    if type == self.SHARED_LIB:
+      subdir = None
+    else:
+      subdir = kw.get('subdir')
+    parts = (kw.get('chdir'), 'out', self.configuration_dirname(),
+             self._type_subdirs.get(type), subdir,
+             self.built_file_basename(name, type, **kw))
+    return self.workpath(*filter(None, parts))
 
   def up_to_date(self, gyp_file, target=None, **kw):
     result = self.build(gyp_file, target, **kw)
@@ -885,15 +1222,17 @@ class TestGypNinja(TestGypOnMSToolchain):
     return result
 
 
+# The summary line devenv prints for a build in which nothing was done.
+_MSVS_UP_TO_DATE_RE = re.compile(
+    r'=== Build: 0 succeeded, 0 failed, (\d+) up-to-date, 0 skipped ===')
+
+
 class TestGypMSVS(TestGypOnMSToolchain):
   """
   Subclass for testing the GYP Visual Studio generator.
   """
   format = 'msvs'
 
-  u = r'=== Build: 0 succeeded, 0 failed, (\d+) up-to-date, 0 skipped ==='
-  up_to_date_re = re.compile(u, re.M)
-
   # Initial None element will indicate to our .initialize_build_tool()
   # method below that 'devenv' was not found on %PATH%.
   #
@@ -917,15 +1256,14 @@ class TestGypMSVS(TestGypOnMSToolchain):
       build = '/Rebuild'
     else:
       build = '/Build'
-    arguments = kw.get('arguments', [])[:]
-    arguments.extend([gyp_file.replace('.gyp', '.sln'),
-                      build, configuration])
+    arguments = list(kw.get('arguments', ()))
+    arguments += (_project_file_name(gyp_file, '.sln'), build, configuration)
     # Note:  the Visual Studio generator doesn't add an explicit 'all'
     # target, so we just treat it the same as the default.
     if target not in (None, self.ALL, self.DEFAULT):
-      arguments.extend(['/Project', target])
+      arguments += ('/Project', target)
     if self.configuration:
-      arguments.extend(['/ProjectConfig', self.configuration])
+      arguments += ('/ProjectConfig', self.configuration)
     kw['arguments'] = arguments
     return self.run(program=self.build_tool, **kw)
   def up_to_date(self, gyp_file, target=None, **kw):
@@ -945,14 +1283,16 @@ class TestGypMSVS(TestGypOnMSToolchain):
     """
     result = self.build(gyp_file, target, **kw)
     if not result:
-      stdout = self.stdout()
-
-      m = self.up_to_date_re.search(stdout)
-      up_to_date = m and int(m.group(1)) > 0
-      if not up_to_date:
+      if not self.is_up_to_date_output(self.stdout()):
         self.report_not_up_to_date()
         self.fail_test()
     return result
+  def scan_up_to_date_output(self, stdout):
+    """
+    Returns whether devenv's stdout reports an up-to-date build.
+    """
+    m = _MSVS_UP_TO_DATE_RE.search(stdout)
+    return bool(m and int(m.group(1)) > 0)
   def run_built_executable(self, name, *args, **kw):
     """
     Runs an executable built by Visual Studio.
@@ -961,7 +1301,7 @@ class TestGypMSVS(TestGypOnMSToolchain):
     # Enclosing the name in a list avoids prepending the original dir.
     program = [self.built_file_path(name, type=self.EXECUTABLE, **kw)]
     return self.run(program=program, *args, **kw)
-  def built_file_path(self, name, type=None, **kw):
+  def _built_file_path(self, name, type=None, **kw):
     """
     Returns a path to the specified file name, of the specified type,
     as built by Visual Studio.
@@ -975,15 +1315,58 @@ class TestGypMSVS(TestGypOnMSToolchain):
     "type" values of STATIC_LIB or SHARED_LIB append the necessary
     prefixes and suffixes to a platform-independent library base name.
     """
-    result = []
-    chdir = kw.get('chdir')
-    if chdir:
-      result.append(chdir)
-    result.append(self.configuration_dirname())
     if type == self.STATIC_LIB:
-      result.append('lib')
-    result.append(self.built_file_basename(name, type, **kw))
-    return self.workpath(*result)
+      lib_dir = 'lib'
+    else:
+      lib_dir = None
+    parts = (kw.get('chdir'), self.configuration_dirname(), lib_dir,
+             self.built_file_basename(name, type, **kw))
+    return self.workpath(*filter(None, parts))
+
+
+# Various actions or rules can run even when the overall build target
+# is up to date.  TestGypXcode.up_to_date() strips those phases'
+# GYP-generated output.
+_XCODE_PHASE_SCRIPT_EXECUTION = (
+    "\n"
+    "PhaseScriptExecution /(?:[^\\s/]+/)+Script-[0-9A-F]+\\.sh\n"
+    "    cd /\\S+\n"
+    "    /bin/sh -c /(?:[^\\s/]+/)+Script-[0-9A-F]+\\.sh\n"
+    "(make: Nothing to be done for `all'\\.\n)?")
+
+# The message from distcc_pump can trail the "BUILD SUCCEEDED"
+# message, so strip that, too.
+_XCODE_DISTCC_SHUTDOWN = (
+    '__________Shutting down distcc-pump include server\n')
+
+# Both of the above, fused so the output is only scanned once.
+_XCODE_STRIP_RE = re.compile('(?:%s)|(?:%s)' % (_XCODE_PHASE_SCRIPT_EXECUTION,
+                                                _XCODE_DISTCC_SHUTDOWN),
+                             re.S)
+
+# Marks the spurious Xcode 4 stderr lines _xcode_match_filter() drops.
+_XCODE_NOISE_SUBSTR = 'No recorder, buildTask: <Xcode3BuildTask:'
+_XCODE_NOISE_LINE_RE = re.compile(
+    '^.*%s.*\n' % re.escape(_XCODE_NOISE_SUBSTR), re.M)
+
+def _xcode_match_filter(match, actual, expected):
+  """
+  Calls match() after dropping the Xcode 4 noise lines from actual.
+  """
+  if actual:
+    actual_is_list = _is_list(actual)
+    if not actual_is_list and actual.endswith('\n'):
+      # Every line, noise included, ends in a newline, so the noise can
+      # be cut out of the string without splitting it into lines.
+      if _XCODE_NOISE_SUBSTR in actual:
+        actual = _XCODE_NOISE_LINE_RE.sub('', actual)
+    else:
+      if not actual_is_list:
+        actual = actual.split('\n')
+      if not _is_list(expected):
+        expected = expected.split('\n')
+      actual = [a for a in actual if _XCODE_NOISE_SUBSTR not in a]
+  return match(actual, expected)
 
 
 class TestGypXcode(TestGypBase):
@@ -993,22 +1376,6 @@ class TestGypXcode(TestGypBase):
   format = 'xcode'
   build_tool_list = ['xcodebuild']
 
-  phase_script_execution = ("\n"
-                            "PhaseScriptExecution /\\S+/Script-[0-9A-F]+\\.sh\n"
-                            "    cd /\\S+\n"
-                            "    /bin/sh -c /\\S+/Script-[0-9A-F]+\\.sh\n"
-                            "(make: Nothing to be done for `all'\\.\n)?")
-
-  strip_up_to_date_expressions = [
-    # Various actions or rules can run even when the overall build target
-    # is up to date.  Strip those phases' GYP-generated output.
-    re.compile(phase_script_execution, re.S),
-
-    # The message from distcc_pump can trail the "BUILD SUCCEEDED"
-    # message, so strip that, too.
-    re.compile('__________Shutting down distcc-pump include server\n', re.S),
-  ]
-
   up_to_date_endings = (
     'Checking Dependencies...\n** BUILD SUCCEEDED **\n', # Xcode 3.0/3.1
     'Check dependencies\n** BUILD SUCCEEDED **\n\n',     # Xcode 3.2
@@ -1016,6 +1383,12 @@ class TestGypXcode(TestGypBase):
     'Check dependencies\n\n** BUILD SUCCEEDED **\n\n',   # Xcode 5.0
   )
 
+  # Any of up_to_date_endings, anchored at the end of the output.  Only
+  # the last _up_to_date_tail characters of the output are searched.
+  _up_to_date_end_re = re.compile(
+      '(?:%s)\\Z' % '|'.join(map(re.escape, up_to_date_endings)))
+  _up_to_date_tail = max(map(len, up_to_date_endings))
+
   def build(self, gyp_file, target=None, **kw):
     """
     Runs an xcodebuild using the .xcodeproj generated from the specified
@@ -1023,14 +1396,14 @@ class TestGypXcode(TestGypBase):
     """
     # Be sure we're working with a copy of 'arguments' since we modify it.
     # The caller may not be expecting it to be modified.
-    arguments = kw.get('arguments', [])[:]
-    arguments.extend(['-project', gyp_file.replace('.gyp', '.xcodeproj')])
+    arguments = list(kw.get('arguments', ()))
+    arguments += ('-project', _project_file_name(gyp_file, '.xcodeproj'))
     if target == self.ALL:
-      arguments.append('-alltargets',)
+      arguments.append('-alltargets')
     elif target not in (None, self.DEFAULT):
-      arguments.extend(['-target', target])
+      arguments += ('-target', target)
     if self.configuration:
-      arguments.extend(['-configuration', self.configuration])
+      arguments += ('-configuration', self.configuration)
     symroot = kw.get('SYMROOT', '$SRCROOT/build')
     if symroot:
       arguments.append('SYMROOT='+symroot)
@@ -1038,16 +1411,7 @@ class TestGypXcode(TestGypBase):
 
     # Work around spurious stderr output from Xcode 4, http://crbug.com/181012
     match = kw.pop('match', self.match)
-    def match_filter_xcode(actual, expected):
-      if actual:
-        if not TestCmd.is_List(actual):
-          actual = actual.split('\n')
-        if not TestCmd.is_List(expected):
-          expected = expected.split('\n')
-        actual = [a for a in actual
-                    if 'No recorder, buildTask: <Xcode3BuildTask:' not in a]
-      return match(actual, expected)
-    kw['match'] = match_filter_xcode
+    kw['match'] = functools.partial(_xcode_match_filter, match)
 
     return self.run(program=self.build_tool, **kw)
   def up_to_date(self, gyp_file, target=None, **kw):
@@ -1056,23 +1420,35 @@ class TestGypXcode(TestGypBase):
     """
     result = self.build(gyp_file, target, **kw)
     if not result:
-      output = self.stdout()
-      for expression in self.strip_up_to_date_expressions:
-        output = expression.sub('', output)
-      if not output.endswith(self.up_to_date_endings):
+      if not self.is_up_to_date_output(self.stdout()):
         self.report_not_up_to_date()
         self.fail_test()
     return result
+  def scan_up_to_date_output(self, stdout):
+    """
+    Returns whether xcodebuild's stdout reports an up-to-date build.
+    """
+    # Every one of up_to_date_endings includes this; without it there is
+    # no point stripping the output.
+    if '** BUILD SUCCEEDED **' not in stdout:
+      return False
+    output = stdout
+    # Only copy the output through the substitution if there is
+    # something for it to strip.
+    if ('PhaseScriptExecution' in output or
+        _XCODE_DISTCC_SHUTDOWN in output):
+      output = _XCODE_STRIP_RE.sub('', output)
+    start = max(0, len(output) - self._up_to_date_tail)
+    return self._up_to_date_end_re.search(output, start) is not None
   def run_built_executable(self, name, *args, **kw):
     """
     Runs an executable built by xcodebuild.
     """
-    configuration = self.configuration_dirname()
-    os.environ['DYLD_LIBRARY_PATH'] = os.path.join('build', configuration)
+    _set_environ('DYLD_LIBRARY_PATH', self._output_dir('build'))
     # Enclosing the name in a list avoids prepending the original dir.
     program = [self.built_file_path(name, type=self.EXECUTABLE, **kw)]
     return self.run(program=program, *args, **kw)
-  def built_file_path(self, name, type=None, **kw):
+  def _built_file_path(self, name, type=None, **kw):
     """
     Returns a path to the specified file name, of the specified type,
     as built by Xcode.
@@ -1086,14 +1462,9 @@ class TestGypXcode(TestGypBase):
     "type" values of STATIC_LIB or SHARED_LIB append the necessary
     prefixes and suffixes to a platform-independent library base name.
     """
-    result = []
-    chdir = kw.get('chdir')
-    if chdir:
-      result.append(chdir)
-    configuration = self.configuration_dirname()
-    result.extend(['build', configuration])
-    result.append(self.built_file_basename(name, type, **kw))
-    return self.workpath(*result)
+    parts = (kw.get('chdir'), 'build', self.configuration_dirname(),
+             self.built_file_basename(name, type, **kw))
+    return self.workpath(*filter(None, parts))
 
 
 format_class_list = [
@@ -1106,12 +1477,15 @@ format_class_list = [
   TestGypXcode,
 ]
 
+# Maps each format name to its class in format_class_list.
+_format_classes = dict((c.format, c) for c in format_class_list)
+
 def TestGyp(*args, **kw):
   """
   Returns an appropriate TestGyp* instance for a specified GYP format.
   """
   format = kw.pop('format', os.environ.get('TESTGYP_FORMAT'))
-  for format_class in format_class_list:
-    if format == format_class.format:
-      return format_class(*args, **kw)
-  raise Exception, "unknown format %r" % format
+  format_class = _format_classes.get(format)
+  if format_class is None:
+    raise Exception("unknown format %r" % format)
+  return format_class(*args, **kw)